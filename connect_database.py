@@ -1,9 +1,110 @@
 # pip install psycopg2 
 # pip install mysql-connector-python
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
 import psycopg2
 import mysql.connector
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
+
+# Per-connection settings for the read-heavy chatbot workload:
+# relaxed fsync, in-memory temp tables, 64 MiB page cache, 256 MiB mmap.
+SQLITE_READ_PRAGMAS = """
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+    PRAGMA mmap_size=268435456;
+"""
+
+# Idle connections kept per distinct config and shared by every session, so a
+# schema read or query reuses a warm connection instead of paying the
+# connect (TCP + auth) cost. Connections are checked out only for the duration
+# of one schema read or query, and at most POOL_MAX_CONNECTIONS per config are
+# open on the server at once; further checkouts wait up to
+# POOL_CHECKOUT_TIMEOUT seconds for one to be released.
+POOL_MAX_CONNECTIONS = 5
+POOL_MAX_IDLE = 5
+POOL_CHECKOUT_TIMEOUT = 30
+# Idle connections are pinged before reuse only after sitting this many
+# seconds; one released moments ago is assumed to still be alive
+POOL_PING_AFTER = 30
+# Pool key -> stack of (connection, time.monotonic() when it went idle)
+_IDLE: Dict[tuple, list] = {}
+# Pool key -> semaphore counting the connections checked out for that config
+_SLOTS: Dict[tuple, threading.BoundedSemaphore] = {}
+_POOL_LOCK = threading.Lock()
+# id(connection) -> (pool key, db type) for connections currently checked out
+_CHECKED_OUT: Dict[int, tuple] = {}
+
+def _pool_key(config: Dict[str, Any]) -> tuple:
+    return (
+        config.get("type"), config.get("host"), config.get("port"),
+        config.get("user"), config.get("password"), config.get("database"),
+    )
+
+def _open_connection(config: Dict[str, Any]):
+    """
+    Opens a new driver connection for `config`. The session is made read-only,
+    so a generated query can't write even through a function with side effects
+    (e.g. `SELECT nextval('s')`) that SQL validation lets through.
+    """
+    db_type = config.get("type")
+    if db_type == "sqlite":
+        # Streamlit reruns the script on different threads, so the
+        # connection must not be pinned to the one that opened it
+        conn = sqlite3.connect(config["database"], check_same_thread=False)
+        conn.executescript(SQLITE_READ_PRAGMAS)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL;")
+        except sqlite3.OperationalError:
+            # WAL needs write access to the database file and directory
+            pass
+        # After switching to WAL, which itself writes to the file
+        conn.execute("PRAGMA query_only=ON;")
+        return conn
+    if db_type == "postgres":
+        conn = psycopg2.connect(
+            host=config["host"], port=config["port"], user=config["user"],
+            password=config["password"], dbname=config["database"]
+        )
+        conn.set_session(readonly=True)
+        return conn
+    if db_type in ["mysql", "mariadb"]:
+        conn = mysql.connector.connect(
+            host=config["host"], port=config["port"], user=config["user"],
+            password=config["password"], database=config["database"]
+        )
+        cursor = conn.cursor()
+        cursor.execute("SET SESSION TRANSACTION READ ONLY")
+        cursor.close()
+        return conn
+    raise ValueError(f"Unsupported database type: {db_type}")
+
+def _is_alive(conn, db_type: str) -> bool:
+    """Liveness check for an idle connection before it is handed out again."""
+    if db_type == "postgres":
+        # `conn.closed` only reflects closes psycopg2 has already seen, so
+        # ping the server to catch restarts and idle timeouts (the transaction
+        # this opens is rolled back when the connection is released)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+    if db_type in ["mysql", "mariadb"]:
+        # mysql-connector pings the server here
+        return conn.is_connected()
+    return True
+
+def _close_quietly(conn) -> None:
+    try:
+        conn.close()
+    except Exception:
+        pass
 
 def create_database_connection(config: Dict[str, Any]):
     """
@@ -14,33 +115,85 @@ def create_database_connection(config: Dict[str, Any]):
                 Must include 'type' ('sqlite', 'postgres', 'mysql', 'mariadb').
                 Other keys depend on the database type (e.g., 'database', 'host', 'port', 'user', 'password').
 
+    The connection is taken from a shared pool of idle connections when one
+    is available and must be handed back with `release_database_connection`
+    (or use `pooled_connection`) as soon as the caller is done with it. If
+    POOL_MAX_CONNECTIONS are already checked out for this config, waits up
+    to POOL_CHECKOUT_TIMEOUT seconds for one to be released.
+
     Returns:
         A database connection object if successful, None otherwise.
     """
     db_type = config.get("type")
-    conn = None
+    key = _pool_key(config)
+    with _POOL_LOCK:
+        slots = _SLOTS.setdefault(key, threading.BoundedSemaphore(POOL_MAX_CONNECTIONS))
+    if not slots.acquire(timeout=POOL_CHECKOUT_TIMEOUT):
+        print(f"Error connecting to database: all {POOL_MAX_CONNECTIONS} connections are busy")
+        return None
     try:
-        if db_type == "sqlite":
-            conn = sqlite3.connect(config["database"])
-        elif db_type == "postgres":
-            conn = psycopg2.connect(
-                host=config["host"], port=config["port"], user=config["user"],
-                password=config["password"], dbname=config["database"]
-            )
-        elif db_type in ["mysql", "mariadb"]:
-            conn = mysql.connector.connect(
-                host=config["host"], port=config["port"], user=config["user"],
-                password=config["password"], database=config["database"]
-            )
-        else:
-            raise ValueError(f"Unsupported database type: {db_type}")
-        print(f"Connected to {db_type} database successfully.")
+        conn = None
+        while conn is None:
+            with _POOL_LOCK:
+                idle = _IDLE.get(key)
+                conn, idle_since = idle.pop() if idle else (None, None)
+            if conn is None:
+                conn = _open_connection(config)
+                print(f"Connected to {db_type} database successfully.")
+            elif time.monotonic() - idle_since > POOL_PING_AFTER and not _is_alive(conn, db_type):
+                _close_quietly(conn)
+                conn = None
+        _CHECKED_OUT[id(conn)] = (key, db_type)
         return conn
     except Exception as e:
+        slots.release()
         print(f"Error connecting to database: {e}")
         return None
 
-def get_db_schema_as_create_statements(connection, db_type: str) -> Optional[str]:
+def release_database_connection(connection) -> None:
+    """
+    Returns a connection obtained from `create_database_connection` to the
+    pool of idle connections, or closes it if the pool is already full.
+
+    Args:
+        connection: The connection to release.
+    """
+    if connection is None:
+        return
+    key, db_type = _CHECKED_OUT.pop(id(connection), (None, None))
+    if key is None:
+        _close_quietly(connection)
+        return
+    try:
+        # End any open transaction so the next user starts from a clean state
+        # (and, on MySQL, sees a fresh snapshot)
+        connection.rollback()
+        with _POOL_LOCK:
+            idle = _IDLE.setdefault(key, [])
+            if len(idle) < POOL_MAX_IDLE:
+                idle.append((connection, time.monotonic()))
+                return
+        _close_quietly(connection)
+    except Exception:
+        _close_quietly(connection)
+    finally:
+        # Only once the connection is idle (or closed), so a waiting checkout
+        # reuses it rather than opening another
+        _SLOTS[key].release()
+
+@contextmanager
+def pooled_connection(config: Dict[str, Any]):
+    """
+    Checks a connection out for the duration of a `with` block and always
+    releases it afterwards. Yields None if no connection could be made.
+    """
+    conn = create_database_connection(config)
+    try:
+        yield conn
+    finally:
+        release_database_connection(conn)
+
+def get_db_schema_as_create_statements(connection, db_type: str) -> Tuple[Optional[str], int]:
     """
     Retrieves the schema of the connected database and formats it
     as a string containing CREATE TABLE statements.
@@ -50,67 +203,42 @@ def get_db_schema_as_create_statements(connection, db_type: str) -> Optional[str
         db_type: The type of the database ('sqlite', 'postgres', 'mysql', 'mariadb').
 
     Returns:
-        A string representing the database schema as CREATE TABLE statements,
-        or None if the connection is invalid or an error occurs.
+        A tuple (schema, table_count): the database schema as a string of
+        CREATE TABLE statements and the number of tables in it, or (None, 0)
+        if the connection is invalid or an error occurs.
     """
-    if not connection or not connection.is_connected():
+    if connection is None:
         print("Error: Invalid connection for schema extraction.")
-        return None
+        return None, 0
 
     cursor = connection.cursor()
     schema_statements = []
 
     try:
         if db_type == "sqlite":
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
-            for (table_name,) in tables:
-                cursor.execute(f"PRAGMA table_info({table_name});")
-                columns = cursor.fetchall()
-                create_table_sql = f"CREATE TABLE {table_name} (\n"
-                column_definitions = []
-                for col in columns:
-                    cid, name, type, notnull, dflt_value, pk = col
-                    col_def = f"    {name} {type.upper()}"
-                    if notnull:
-                        col_def += " NOT NULL"
-                    if dflt_value is not None:
-                        # Simple default handling for SQLite
-                        if isinstance(dflt_value, str):
-                            col_def += f" DEFAULT '{dflt_value.replace("'", "''")}'" # Basic escaping
-                        else:
-                            col_def += f" DEFAULT {dflt_value}"
-                    # PK constraint is often added separately or as part of column definition
-                    # For simplicity, we'll add it as part of definition if pk=1
-                    if pk:
-                         col_def += " PRIMARY KEY" # Simplified: assuming single-column PK or handling here
-
-                    column_definitions.append(col_def)
-
-                # Note: SQLite PRAGMA doesn't give full CREATE TABLE syntax including separate PK constraints, FKs etc.
-                # This is a reconstruction based on available info.
-
-                create_table_sql += ",\n".join(column_definitions) + "\n);"
-                schema_statements.append(create_table_sql)
+            # SQLite keeps the original CREATE TABLE text, including PK/FK
+            # constraints, so read it as-is in a single query
+            cursor.execute("""
+                SELECT sql FROM sqlite_master
+                WHERE type = 'table' AND sql IS NOT NULL AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\';
+            """)
+            schema_statements = [row[0] + ";" for row in cursor.fetchall()]
 
 
         elif db_type == "postgres":
+            # One round-trip for every column of every table, grouped per table below
             cursor.execute("""
-                SELECT table_name FROM information_schema.tables
-                WHERE table_schema = 'public' AND table_type='BASE TABLE';
+                SELECT c.table_name, c.column_name, c.data_type, c.is_nullable, c.column_default
+                FROM information_schema.columns c
+                JOIN information_schema.tables t
+                  ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+                WHERE c.table_schema = 'public' AND t.table_type = 'BASE TABLE'
+                ORDER BY c.table_name, c.ordinal_position;
             """)
-            tables = cursor.fetchall()
-            for (table_name,) in tables:
-                 cursor.execute("""
-                     SELECT column_name, data_type, is_nullable, column_default
-                     FROM information_schema.columns
-                     WHERE table_schema = 'public' AND table_name = %s
-                     ORDER BY ordinal_position;
-                 """, (table_name,))
-                 columns = cursor.fetchall()
+            for table_name, columns in groupby(cursor.fetchall(), key=itemgetter(0)):
                  create_table_sql = f"CREATE TABLE {table_name} (\n"
                  column_definitions = []
-                 for col_name, data_type, is_nullable, column_default in columns:
+                 for _, col_name, data_type, is_nullable, column_default in columns:
                      col_def = f"    {col_name} {data_type.upper()}"
                      if is_nullable == 'NO':
                          col_def += " NOT NULL"
@@ -130,32 +258,29 @@ def get_db_schema_as_create_statements(connection, db_type: str) -> Optional[str
 
 
         elif db_type in ["mysql", "mariadb"]:
-            cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE()")
-            tables = [row[0] for row in cursor.fetchall()]
-
-            for table_name in tables:
-                cursor.execute(
-                    """
-                    SELECT
-                        column_name,
-                        column_type,
-                        is_nullable,
-                        column_key,
-                        column_default,
-                        extra
-                    FROM information_schema.columns
-                    WHERE table_schema = DATABASE() AND table_name = %s
-                    ORDER BY ordinal_position
-                    """,
-                    (table_name,)
-                )
-                columns = cursor.fetchall()
+            # One round-trip for every column of every table, grouped per table below
+            cursor.execute(
+                """
+                SELECT
+                    table_name,
+                    column_name,
+                    column_type,
+                    is_nullable,
+                    column_key,
+                    column_default,
+                    extra
+                FROM information_schema.columns
+                WHERE table_schema = DATABASE()
+                ORDER BY table_name, ordinal_position
+                """
+            )
 
+            for table_name, columns in groupby(cursor.fetchall(), key=itemgetter(0)):
                 create_table_sql = f"CREATE TABLE {table_name} (\n"
                 column_definitions = []
 
                 for col in columns:
-                    col_name, col_type, is_nullable, column_key, column_default, extra = col
+                    _, col_name, col_type, is_nullable, column_key, column_default, extra = col
                     col_definition = f"    {col_name} {col_type.upper()}"
 
                     if is_nullable == 'NO':
@@ -186,16 +311,16 @@ def get_db_schema_as_create_statements(connection, db_type: str) -> Optional[str
         else:
              # This case should theoretically not be reached if create_database_connection validates type
              print(f"Warning: Schema extraction not fully implemented or supported for type: {db_type}")
-             return None
+             return None, 0
 
 
         full_schema_string = "\n\n".join(schema_statements)
         print("Schema extracted successfully.")
-        return full_schema_string
+        return full_schema_string, len(schema_statements)
 
     except Exception as e:
         print(f"Error extracting schema: {e}")
-        return None
+        return None, 0
     finally:
          # Ensure the cursor is closed, but NOT the connection
          if cursor:
@@ -213,7 +338,7 @@ def execute_sql_query(connection, sql_query: str) -> Optional[list]:
         A list of result rows if the query is successful and returns data,
         or None if the connection is invalid, an error occurs, or the query returns no data.
     """
-    if not connection or not connection.is_connected():
+    if connection is None:
         print("Error: Invalid connection for query execution.")
         return None
 
@@ -261,7 +386,7 @@ def execute_sql_query(connection, sql_query: str) -> Optional[list]:
 #         if conn:
 #             # 2. Get the database schema
 #             # Make sure to pass the connection object and type
-#             database_schema_string = get_db_schema_as_create_statements(conn, config["type"])
+#             database_schema_string, table_count = get_db_schema_as_create_statements(conn, config["type"])
 
 #             if database_schema_string:
 #                 print("\n--- Extracted Database Schema (CREATE TABLE statements) ---")
@@ -10,7 +10,9 @@ into the conversation.  The full chat history is retained in
 Dependencies
 ------------
 streamlit>=1.31
-pandas
+pandas>=2.0
+pyarrow
+sqlglot
 psycopg2‑binary  # only if you need Postgres
 mysql‑connector‑python  # only if you need MySQL / MariaDB
 sqlite3 (built‑in)
@@ -28,14 +30,20 @@ streamlit run streamlit_sql_chatbot_app.py
 
 from __future__ import annotations
 
+import hashlib
+
 import streamlit as st
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import sqlglot
+from sqlglot import exp
 
 from connect_database import (
-    create_database_connection,
     get_db_schema_as_create_statements,
+    pooled_connection,
 )
-from text2sql import generate as nl_to_sql
+from text2sql import generate_stream, parse_json
 
 # -------------------------------------------------------
 # ----------  Streamlit page styling & helpers ----------
@@ -71,10 +79,15 @@ def init_state() -> None:
     """Make sure every key we rely on exists in `st.session_state`."""
     defaults = {
         "connected": False,
-        "connection": None,
+        "db_config": None,  # connections are checked out from the pool per query
         "db_type": None,
         "schema": None,
+        "schema_hash": None,
+        "table_count": 0,
         "messages": [],  # list[dict(role, content)]
+        "schema_key": None,
+        "schema_cache": {},  # (db_type, host, port, database, user) -> (schema string, table count)
+        "sql_cache": {},  # (normalised question, schema_hash) -> generated SQL
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -128,27 +141,37 @@ def connection_form() -> None:
         "password": password,
     }
 
-    with st.spinner("Connecting ..."):
-        conn = create_database_connection(cfg)
-
-    if conn is None:
-        st.error("❌ Could not connect. Please double‑check your credentials.")
-        return
-
-    # Fetch and cache the DB schema so we can feed it to Gemini later
-    with st.spinner("Reading schema ..."):
-        schema_str = get_db_schema_as_create_statements(conn, db_type)
+    with st.spinner("Connecting ..."), pooled_connection(cfg) as conn:
+        if conn is None:
+            st.error("❌ Could not connect. Please double‑check your credentials.")
+            return
+
+        # Fetch and cache the DB schema so we can feed it to Gemini later;
+        # reconnecting to the same database as the same user reuses the
+        # cached copy (information_schema only lists the user's own tables)
+        schema_key = (db_type, host, int(port), db_file_or_name, user)
+        cached = st.session_state.schema_cache.get(schema_key)
+        if cached is None:
+            with st.spinner("Reading schema ..."):
+                schema_str, table_count = get_db_schema_as_create_statements(conn, db_type)
+            if schema_str:
+                st.session_state.schema_cache[schema_key] = (schema_str, table_count)
+        else:
+            schema_str, table_count = cached
 
     if not schema_str:
         st.error("❌ Connected, but failed to obtain schema. Aborting.")
-        conn.close()
         return
 
     # Success: persist details in the session and rerun so the chat UI shows
     st.session_state.connected = True
-    st.session_state.connection = conn
+    st.session_state.db_config = cfg
     st.session_state.db_type = db_type
+    st.session_state.schema_key = schema_key
     st.session_state.schema = schema_str
+    st.session_state.schema_hash = hashlib.blake2b(schema_str.encode(), digest_size=16).hexdigest()
+    # Reported by the schema reader, so the sidebar doesn't rescan the schema on every rerun
+    st.session_state.table_count = table_count
 
     st.success("✅ Connected successfully!  Scroll down to chat …")
     st.rerun()# st.experimental_rerun()
@@ -167,33 +190,132 @@ def display_message(role: str, content: str | pd.DataFrame):
             st.markdown(content)
 
 
+def _arrow_coerced(arr: pa.Array, values: tuple) -> bool:
+    """True if `pa.array` had to change values to fit the type it inferred."""
+    t = arr.type
+    # Dicts with different keys become structs padded with None
+    if pa.types.is_nested(t):
+        return True
+    # A str anywhere in a bytes column is silently encoded (and vice versa)
+    if pa.types.is_binary(t):
+        return True
+    if pa.types.is_timestamp(t):
+        # The zone is taken from the first value: naive and aware timestamps
+        # mixed in one column would be reinterpreted, so scan this type only
+        aware = t.tz is not None
+        return any(v is not None and (v.tzinfo is None) is aware for v in values)
+    return False
+
+
+def _column_array(values: tuple):
+    """Typed Arrow array for one result column, or an object array if Arrow can't type it exactly."""
+    try:
+        arr = pa.array(values)
+        if not _arrow_coerced(arr, values):
+            return pd.arrays.ArrowExtensionArray(arr)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        pass
+    # e.g. an SQLite column holding values of mixed types
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+def rows_to_dataframe(rows: list[tuple], cols: list[str]) -> pd.DataFrame:
+    """Build a DataFrame column by column (row tuples → column arrays) from DB-API rows."""
+    columns = zip(*rows) if rows else [()] * len(cols)
+    # Integer keys keep duplicate column names (e.g. two `id`s from a join) apart
+    df = pd.DataFrame({i: _column_array(values) for i, values in enumerate(columns)}, copy=False)
+    df.columns = cols
+    return df
+
+
+# Upper bound on rows fetched for a generated query that has no LIMIT of its own
+MAX_RESULT_ROWS = 1000
+
+SQLGLOT_DIALECTS = {"sqlite": "sqlite", "postgres": "postgres", "mysql": "mysql", "mariadb": "mysql"}
+
+
+# Statements that write or change the schema, wherever they appear in the tree
+# (e.g. a data-modifying CTE: `WITH x AS (DELETE ... RETURNING *) SELECT ...`)
+_WRITE_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop,
+    exp.Alter, exp.TruncateTable, exp.Command,
+)
+
+
+def guard_sql(sql: str, db_type: str) -> str:
+    """
+    Reject anything but a single SELECT without write or locking clauses, and
+    cap its result at `MAX_RESULT_ROWS`. Functions with side effects can't be
+    told apart here; the pooled connections are read-only for those.
+    """
+    dialect = SQLGLOT_DIALECTS.get(db_type)
+    expr = sqlglot.parse_one(sql, read=dialect)
+    if not isinstance(expr, exp.Query):
+        # Also catches several statements in one string (parsed as a block)
+        raise ValueError(f"only a single SELECT query is allowed, got {expr.key.upper()}")
+    for node in expr.walk():
+        if isinstance(node, _WRITE_NODES):
+            raise ValueError(f"{node.key.upper()} is not allowed inside a SELECT query")
+        # `SELECT ... INTO newt` creates a table; `FOR UPDATE`/`FOR SHARE` take row locks
+        if node.args.get("into") or node.args.get("locks"):
+            raise ValueError("SELECT ... INTO and locking clauses are not allowed")
+    if not expr.args.get("limit"):
+        expr = expr.limit(MAX_RESULT_ROWS, copy=False)
+    return expr.sql(dialect=dialect)
+
+
+SQL_CACHE_MAX_ENTRIES = 256
+
+
 def run_sql_safe(question: str) -> tuple[str | None, pd.DataFrame | None]:
     """Turn natural language into SQL, execute it, and return (sql, dataframe)."""
 
-    # 1 — LLM → SQL
-    sql_json = nl_to_sql(question, st.session_state.schema)
-
-    sql = None
-    if isinstance(sql_json, dict):
-        # `text2sql` might return {"sql": "..."} or {"query": "..."}
-        sql = sql_json.get("sql") or sql_json.get("query")
+    # 1 — LLM → SQL; a question already answered for this schema reuses
+    # that SQL, new ones are streamed into a temporary bubble
+    cache_key = (question.strip().lower(), st.session_state.schema_hash)
+    sql = st.session_state.sql_cache.get(cache_key)
+
+    if sql is None:
+        placeholder = st.empty()
+        with placeholder.container():
+            with st.chat_message("assistant"):
+                response = st.write_stream(generate_stream(question, st.session_state.schema))
+        placeholder.empty()
+        sql_json = parse_json(response)
+
+        if isinstance(sql_json, dict):
+            # `text2sql` might return {"sql": "..."} or {"query": "..."}
+            sql = sql_json.get("sql") or sql_json.get("query")
+
+        if sql:
+            if len(st.session_state.sql_cache) >= SQL_CACHE_MAX_ENTRIES:
+                # Evict the oldest entry (dicts keep insertion order)
+                st.session_state.sql_cache.pop(next(iter(st.session_state.sql_cache)))
+            st.session_state.sql_cache[cache_key] = sql
 
     if not sql:
         return None, None
 
     # 2 — Run the query and return a DataFrame
     try:
-        cur = st.session_state.connection.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        cols = [desc[0] for desc in cur.description]
-        df = pd.DataFrame(rows, columns=cols)
-        cur.close()
+        safe_sql = guard_sql(sql, st.session_state.db_type)
+        # Hold a pooled connection only for this one query
+        with pooled_connection(st.session_state.db_config) as conn:
+            if conn is None:
+                raise ConnectionError("could not get a database connection")
+            cur = conn.cursor()
+            try:
+                cur.execute(safe_sql)
+                rows = cur.fetchall()
+                cols = [desc[0] for desc in cur.description]
+            finally:
+                cur.close()
+        df = rows_to_dataframe(rows, cols)
     except Exception as ex:  # pylint: disable=broad-except
         st.error(f"SQL execution failed: {ex}")
         return sql, None
 
-    return sql, df
+    return safe_sql, df
 
 
 # -------------------------------------------------------
@@ -210,13 +332,23 @@ if not st.session_state.connected:
 st.sidebar.header("Current connection")
 with st.sidebar.container():
     st.write(f"**Type:** {st.session_state.db_type}")
-    st.write(f"**Schema tables:** {st.session_state.schema.count('CREATE TABLE')}")
+    st.write(f"**Schema tables:** {st.session_state.table_count}")
+    if st.sidebar.button("🔄 Refresh schema"):
+        # Drop the cached copy and read the schema again, e.g. after DDL changes
+        st.session_state.schema_cache.pop(st.session_state.schema_key, None)
+        with st.spinner("Reading schema ..."), pooled_connection(st.session_state.db_config) as conn:
+            schema_str, table_count = get_db_schema_as_create_statements(conn, st.session_state.db_type)
+        if schema_str:
+            st.session_state.schema_cache[st.session_state.schema_key] = (schema_str, table_count)
+            st.session_state.schema = schema_str
+            st.session_state.schema_hash = hashlib.blake2b(schema_str.encode(), digest_size=16).hexdigest()
+            st.session_state.table_count = table_count
+            st.rerun()
+        else:
+            st.sidebar.error("❌ Failed to read the schema; keeping the previous one.")
     if st.sidebar.button("🔒 Disconnect"):
-        try:
-            st.session_state.connection.close()
-        except Exception:  # pragma: no cover
-            pass
-        for k in ["connected", "connection", "db_type", "schema", "messages"]:
+        # Nothing to close: connections go back to the pool after each query
+        for k in ["connected", "db_config", "db_type", "schema_key", "schema", "schema_hash", "table_count", "messages"]:
             st.session_state.pop(k, None)
         st.experimental_rerun()
 
@@ -1,94 +1,310 @@
-# pip install -qU transformers json-repair==0.29.1
+# pip install -qU transformers json-repair==0.29.1 orjson
 # pip install torch torchvision torchaudio
 # pip install huggingface_hub
+# pip install bitsandbytes peft
+# pip install lm-format-enforcer
 # huggingface-cli login --token {}
+# Optional, to serve the model with vLLM instead of loading it in-process:
+# vllm serve google/gemma-3-1b-it --enable-lora --lora-modules text2sql=OmarAladdin/gemma-3-1b-text2sql --enable-prefix-caching
+# export TEXT2SQL_SERVER_URL=http://localhost:8000
 
 import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import torch
 from pydantic import BaseModel, Field
 import json_repair
-from transformers import AutoModelForCausalLM, AutoTokenizer
+import orjson
+from lmformatenforcer import JsonSchemaParser
+from lmformatenforcer.integrations.transformers import (
+    build_token_enforcer_tokenizer_data,
+    build_transformers_prefix_allowed_tokens_fn,
+)
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    BitsAndBytesConfig,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+)
+
+base_model_id = "google/gemma-3-1b-it"
+adapter_id = "OmarAladdin/gemma-3-1b-text2sql"
+device = "cuda"
+# 4-bit NF4 weights; the LoRA adapter stays in bf16 on top.
+quantization_config = BitsAndBytesConfig(
+    load_in_4bit=True,
+    bnb_4bit_compute_dtype=torch.bfloat16,
+    bnb_4bit_quant_type="nf4",
+)
+# Compile the forward pass with CUDA graphs over a static KV cache. Prompts
+# are left-padded to one of these lengths so the captured graphs are reused.
+compile_model = True
+prompt_buckets = (512, 1024, 2048, 4096)
+
+# When set, `generate` calls this vLLM (OpenAI-compatible) server instead of
+# running the model locally, so concurrent users share its batching.
+server_url = os.environ.get("TEXT2SQL_SERVER_URL")
+server_model = os.environ.get("TEXT2SQL_SERVER_MODEL", "text2sql")
+
+# Loaded once on first use and shared by every call to `generate`.
+_MODEL = None
+_TOK = None
+# Vocabulary index used to constrain decoding to the `generate_query` schema
+_TOKENIZER_DATA = None
+_LOAD_LOCK = threading.Lock()
+# Every local `model.generate` call runs on this one long-lived thread: the
+# static KV cache on the model is shared, so calls must take turns, and
+# torch.compile records its CUDA graphs per thread, so a fresh thread per
+# request would capture them all over again.
+_GENERATE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="text2sql-generate")
+
+# Page-locked host buffers (sized for the largest prompt bucket) and a side
+# stream used to copy each prompt to the GPU; guarded by _H2D_LOCK because
+# concurrent sessions share them.
+_PINNED_IDS = None
+_PINNED_MASK = None
+_COPY_STREAM = None
+_H2D_LOCK = threading.Lock()
 
 
 class generate_query(BaseModel):
     query: str = Field(..., min_length=5, description="The SQL statement that retrieves.")
 
+# The parts of the prompt that never change, built once at import time.
+_QUERY_SCHEMA = generate_query.model_json_schema()
+
+_SYSTEM_MESSAGE = "\n".join([
+    "You are a helpful assistant specialized in converting natural language questions into SQL queries.",
+    "You will be provided with an task description containing an SQL table schema and a query question.",
+    "Generate the output strictly in JSON, following the provided Pydantic schema.",
+    "Extract exactly the fields defined in the schema; do not add, remove, or rename any fields.",
+    "Do not include any additional introduction, explanation, or conclusion."
+])
+
+_USER_TEMPLATE = "\n".join([
+    "## Question:",
+    "{question}",
+    "",
+
+    "## Schema:",
+    "{schema}",
+    "",
+
+    "## Pydantic Details:",
+    # Braces are doubled so str.format leaves the JSON untouched
+    json.dumps(_QUERY_SCHEMA, ensure_ascii=False).replace("{", "{{").replace("}", "}}"),
+    "",
+
+    "## Story Details:",
+    "```json"
+])
+
 def parse_json(text):
+    # Decoding is constrained to the schema, so responses are normally valid
+    # JSON; json_repair is only a last resort (e.g. output cut off early).
+    text = text.strip().removeprefix("```json").removesuffix("```").strip()
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        pass
     try:
         return json_repair.loads(text)
     except:
         return None
 
-def generate(question, schema):
-    sql_guery_generation = [
-        {
-            "role": "system",
-            "content": "\n".join([
-                "You are a helpful assistant specialized in converting natural language questions into SQL queries.",
-                "You will be provided with an task description containing an SQL table schema and a query question.",
-                "Generate the output strictly in JSON, following the provided Pydantic schema.",
-                "Extract exactly the fields defined in the schema; do not add, remove, or rename any fields.",
-                "Do not include any additional introduction, explanation, or conclusion."
-            ])
-        },
-        {
-            "role": "user",
-            "content": "\n".join([
-                "## Question:",
-                question.strip(),
-                "",
-
-                "## Schema:",
-                schema.strip(),
-                "",
-
-                "## Pydantic Details:",
-                json.dumps(
-                    generate_query.model_json_schema(), ensure_ascii=False
-                ),
-                "",
-
-                "## Story Details:",
-                "```json"
-            ])
-        }
+def _get_model():
+    global _MODEL, _TOK, _TOKENIZER_DATA, _PINNED_IDS, _PINNED_MASK, _COPY_STREAM
+    if _MODEL is None:
+        with _LOAD_LOCK:
+            if _MODEL is None:
+                model = AutoModelForCausalLM.from_pretrained(
+                    base_model_id,
+                    device_map=device,
+                    torch_dtype=torch.bfloat16,
+                    quantization_config=quantization_config
+                )
+                model.load_adapter(adapter_id)
+                model.eval()
+                if compile_model:
+                    model.generation_config.cache_implementation = "static"
+                    model.forward = torch.compile(model.forward, mode="reduce-overhead")
+                _TOK = AutoTokenizer.from_pretrained(base_model_id, padding_side="left")
+                _TOKENIZER_DATA = build_token_enforcer_tokenizer_data(_TOK)
+                max_length = max(prompt_buckets)
+                _PINNED_IDS = torch.empty((1, max_length), dtype=torch.long, pin_memory=True)
+                _PINNED_MASK = torch.empty((1, max_length), dtype=torch.long, pin_memory=True)
+                _COPY_STREAM = torch.cuda.Stream()
+                _MODEL = model
+    return _MODEL, _TOK
+
+class _StopWhenJsonClosed(StoppingCriteria):
+    """
+    Stops decoding as soon as the answer's JSON object is complete.
+
+    Only the tokens generated since the previous call are decoded and fed
+    through a running brace/string scanner, so each step is O(new tokens).
+    """
+
+    def __init__(self, tokenizer, prompt_length):
+        self.tokenizer = tokenizer
+        self.seen = prompt_length
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.done = False
+
+    def _feed(self, text):
+        for ch in text:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"' and self.depth:
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}" and self.depth:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.done = True
+                    return
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if not self.done:
+            # Braces, quotes and backslashes are single-byte characters, so
+            # decoding only the newest tokens never splits one of them
+            new_ids = input_ids[0, self.seen:]
+            self.seen = input_ids.shape[1]
+            self._feed(self.tokenizer.decode(new_ids, skip_special_tokens=True))
+        return torch.full((input_ids.shape[0],), self.done, dtype=torch.bool, device=input_ids.device)
+
+def _bucket_length(n):
+    for size in prompt_buckets:
+        if n <= size:
+            return size
+    return n
+
+def _build_messages(question, schema):
+    return [
+        {"role": "system", "content": _SYSTEM_MESSAGE},
+        {"role": "user", "content": _USER_TEMPLATE.format(question=question.strip(), schema=schema.strip())},
     ]
 
-    base_model_id = "google/gemma-3-1b-it" 
-    device = "cuda"
-    torch_dtype = None
+def generate_stream(question, schema):
+    """Yield the raw model response piece by piece as it is decoded."""
+    sql_guery_generation = _build_messages(question, schema)
 
-    model = AutoModelForCausalLM.from_pretrained(
-        base_model_id,
-        device_map="cuda",
-        torch_dtype = torch_dtype
-    )
+    if server_url:
+        yield from _stream_remote(sql_guery_generation)
+    else:
+        yield from _stream_local(sql_guery_generation)
+
+def generate(question, schema):
+    return parse_json("".join(generate_stream(question, schema)))
+
+def _run_generate(model, streamer, **kwargs):
+    try:
+        with torch.inference_mode():
+            model.generate(streamer=streamer, **kwargs)
+    except Exception:
+        # Unblock the consumer; the future still carries the error
+        streamer.end()
+        raise
 
-    tokenizer = AutoTokenizer.from_pretrained(base_model_id)
+def _to_device(batch):
+    """Copy a padded (1, n) batch to the GPU through the shared pinned buffers."""
+    n = batch.input_ids.shape[1]
+    if n > _PINNED_IDS.shape[1]:
+        # Longer than every bucket: plain pageable copy
+        batch = batch.to(device)
+        return batch.input_ids, batch.attention_mask
 
-    model.load_adapter("OmarAladdin/gemma-3-1b-text2sql")
+    with _H2D_LOCK:
+        _PINNED_IDS[:, :n].copy_(batch.input_ids)
+        _PINNED_MASK[:, :n].copy_(batch.attention_mask)
+        with torch.cuda.stream(_COPY_STREAM):
+            input_ids = _PINNED_IDS[:, :n].to(device, non_blocking=True)
+            attention_mask = _PINNED_MASK[:, :n].to(device, non_blocking=True)
+        # The next prompt overwrites the pinned buffers, so finish this copy first
+        _COPY_STREAM.synchronize()
+
+    # Allocated on the copy stream but consumed by generate on the default one
+    input_ids.record_stream(torch.cuda.current_stream())
+    attention_mask.record_stream(torch.cuda.current_stream())
+    return input_ids, attention_mask
+
+def _stream_local(messages):
+    model, tokenizer = _get_model()
 
     text = tokenizer.apply_chat_template(
-        sql_guery_generation,
+        messages,
         tokenize=False,
         add_generation_prompt=True
     )
 
-    model_inputs = tokenizer([text], return_tensors="pt").to(device)
+    encoded = tokenizer([text])
+    model_inputs = tokenizer.pad(
+        encoded,
+        padding="max_length",
+        max_length=_bucket_length(len(encoded.input_ids[0])),
+        return_tensors="pt",
+    )
+    input_ids, attention_mask = _to_device(model_inputs)
+    prompt_length = input_ids.shape[1]
 
-    generated_ids = model.generate(
-        model_inputs.input_ids,
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    # Only tokens that keep the output a valid `generate_query` JSON object
+    # can be sampled; built per request as it tracks this prompt's decoding
+    prefix_allowed_tokens_fn = build_transformers_prefix_allowed_tokens_fn(
+        _TOKENIZER_DATA, JsonSchemaParser(_QUERY_SCHEMA)
+    )
+    future = _GENERATE_EXECUTOR.submit(
+        _run_generate,
+        model,
+        streamer,
+        input_ids=input_ids,
+        attention_mask=attention_mask,
         max_new_tokens=1024,
         do_sample=False, top_k=None, temperature=None, top_p=None,
+        prefix_allowed_tokens_fn=prefix_allowed_tokens_fn,
+        stopping_criteria=StoppingCriteriaList([_StopWhenJsonClosed(tokenizer, prompt_length)]),
     )
+    yield from streamer
+    # Re-raises anything `model.generate` raised on the worker thread
+    future.result()
 
-    generated_ids = [
-        output_ids[len(input_ids):]
-        for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-    ]
-
-    response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
-
-    return parse_json(response)
+def _stream_remote(messages):
+    with requests.post(
+        f"{server_url.rstrip('/')}/v1/chat/completions",
+        json={
+            "model": server_model,
+            "messages": messages,
+            "max_tokens": 1024,
+            "temperature": 0,
+            "guided_json": _QUERY_SCHEMA,
+            "stream": True,
+        },
+        stream=True,
+        timeout=120,
+    ) as resp:
+        resp.raise_for_status()
+        # Server-sent events: one "data: {...}" line per chunk, then "data: [DONE]"
+        for line in resp.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            data = line[len(b"data: "):]
+            if data == b"[DONE]":
+                break
+            delta = json.loads(data)["choices"][0]["delta"].get("content")
+            if delta:
+                yield delta
 
 
 